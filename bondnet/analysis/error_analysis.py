@@ -33,7 +33,7 @@ def evaluate(model, nodes, data_loader):
 
             predictions.append(pred.numpy())
             targets.append(tgt.numpy())
-            ids.append([rxn.id for rxn in label["reaction"]])
+            ids.append(label["id"])
 
     predictions = np.concatenate(predictions)
     targets = np.concatenate(targets)
@@ -36,7 +36,7 @@ def evaluate(model, nodes, data_loader):
 
             predictions.append(pred.numpy())
             targets.append(tgt.numpy())
-            ids.append([rxn.id for rxn in label["reaction"]])
+            ids.append(label["id"])
 
             fts = model.feature_at_each_layer(
                 bg, feats, label["reaction"], norm_atom, norm_bond
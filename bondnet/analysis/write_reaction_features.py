@@ -79,7 +79,7 @@ def evaluate(model, nodes, data_loader, compute_features=False):
 
             predictions.append(pred.numpy())
             targets.append(tgt.numpy())
-            ids.append([rxn.id for rxn in label["reaction"]])
+            ids.append(label["id"])
 
             if compute_features:
                 feats = model.feature_before_fc(
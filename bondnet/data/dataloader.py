@@ -1,6 +1,7 @@
 import torch
 import dgl
 import itertools
+from bondnet.data.reaction_network import reaction_gather_index
 
 
 class DataLoader(torch.utils.data.DataLoader):
@@ -64,10 +65,8 @@ class DataLoaderGraphNorm(torch.utils.data.DataLoader):
 
             batched_labels = torch.utils.data.dataloader.default_collate(labels)
 
-            norm_atom = [torch.FloatTensor(s, 1).fill_(s) for s in sizes_atom]
-            norm_bond = [torch.FloatTensor(s, 1).fill_(s) for s in sizes_bond]
-            batched_labels["norm_atom"] = 1.0 / torch.cat(norm_atom).sqrt()
-            batched_labels["norm_bond"] = 1.0 / torch.cat(norm_bond).sqrt()
+            batched_labels["norm_atom"] = _graph_norm(sizes_atom)
+            batched_labels["norm_bond"] = _graph_norm(sizes_bond)
 
             return batched_graphs, batched_labels
 
@@ -220,10 +219,53 @@ class DataLoaderReactionNetwork(torch.utils.data.DataLoader):
             target = torch.stack([la["value"] for la in labels])
             identifier = [la["id"] for la in labels]
 
+            # reaction graphs have the same structure as the reactants; features are
+            # gathered from the molecule graphs using the index
+            rxn_graphs = [graphs[rxn.reactants[0]] for rxn in reactions]
+            rxn_index = reaction_gather_index(reactions, sizes_atom, sizes_bond)
+            rxn_index = {
+                nt: {k: torch.from_numpy(v) for k, v in idx.items()}
+                for nt, idx in rxn_index.items()
+            }
+
+            # atom: graph with edges from product nodes to reactant nodes, used to
+            # compute products feats minus reactant feats in a single fused kernel.
+            # The graph is given its own copy of the edges: dgl.graph() does not copy
+            # them, and when the batch is sent from a worker process, moving the index
+            # tensors to shared memory would leave the graph with freed memory.
+            idx = rxn_index["atom"]
+            idx["graph"] = dgl.graph(
+                (idx["product"].clone(), idx["reactant"].clone()),
+                num_nodes=sum(sizes_atom),
+            )
+
+            # bond and global: bipartite graph with edges from the molecule graph to
+            # the reaction graph, weighted by 1 for products and -1 for reactant, such
+            # that a weighted sum aggregation gives products minus reactant feats.
+            # For bond, the broken bond has no product bond (i.e. zero product feats),
+            # so it only gets the edge from the reactant.
+            idx = rxn_index["bond"]
+            num_rxn_bonds = len(idx["reactant"])
+            not_broken = torch.ones(num_rxn_bonds, dtype=torch.bool)
+            not_broken[idx["broken"]] = False
+            _add_weighted_rxn_graph(
+                idx,
+                idx["product"][not_broken],
+                torch.arange(num_rxn_bonds)[not_broken],
+                sum(sizes_bond),
+            )
+
+            # for global, the product feats are summed over the products of a reaction
+            idx = rxn_index["global"]
+            _add_weighted_rxn_graph(idx, idx["product"], idx["segment"], len(graphs))
+
             batched_labels = {
                 "value": target,
                 "id": identifier,
-                "reaction": reactions,
+                "reaction": {
+                    "graph": dgl.batch(rxn_graphs, ndata=None, edata=None),
+                    "index": rxn_index,
+                },
             }
 
             # add label scaler if it is used
@@ -236,13 +278,144 @@ class DataLoaderReactionNetwork(torch.utils.data.DataLoader):
                 pass
 
             # graph norm
-            norm_atom = [torch.FloatTensor(s, 1).fill_(s) for s in sizes_atom]
-            norm_bond = [torch.FloatTensor(s, 1).fill_(s) for s in sizes_bond]
-            batched_labels["norm_atom"] = 1.0 / torch.cat(norm_atom).sqrt()
-            batched_labels["norm_bond"] = 1.0 / torch.cat(norm_bond).sqrt()
+            batched_labels["norm_atom"] = _graph_norm(sizes_atom)
+            batched_labels["norm_bond"] = _graph_norm(sizes_bond)
 
             return batched_graphs, batched_labels
 
         super(DataLoaderReactionNetwork, self).__init__(
             dataset, collate_fn=collate, **kwargs
         )
+
+
+def _graph_norm(sizes):
+    """
+    Graph norm of the nodes in a batch, i.e. 1/sqrt(n) for each node of a graph with
+    n nodes.
+
+    Args:
+        sizes (list): number of nodes of each graph in the batch.
+
+    Returns:
+        2D tensor: of shape (N, 1), where N is the total number of nodes.
+    """
+    sizes = torch.as_tensor(sizes, dtype=torch.int64)
+    norm = 1.0 / sizes.to(torch.float32).sqrt()
+
+    return norm.repeat_interleave(sizes).view(-1, 1)
+
+
+def _add_weighted_rxn_graph(index, product_src, product_dst, num_mol_nodes):
+    """
+    Add the bipartite graph (as `graph`) from the nodes of the molecule graph to the
+    nodes of the reaction graph, and its edge weights (as `weight`) to `index`.
+
+    Each reaction node gets an edge with weight -1 from its reactant node, given by
+    `index["reactant"]`, and edges with weight 1 from the product nodes `product_src`
+    to `product_dst`.
+    """
+    num_rxn_nodes = len(index["reactant"])
+    src = torch.cat([product_src, index["reactant"]])
+    dst = torch.cat([product_dst, torch.arange(num_rxn_nodes)])
+    index["graph"] = dgl.heterograph(
+        {("molecule", "m2r", "reaction"): (src, dst)},
+        num_nodes_dict={"molecule": num_mol_nodes, "reaction": num_rxn_nodes},
+    )
+    index["weight"] = torch.cat(
+        [torch.ones(len(product_src), 1), -torch.ones(num_rxn_nodes, 1)]
+    )
+
+
+def reactions_to_device(reactions, device, non_blocking=False):
+    """
+    Move the reactions created by :class:`DataLoaderReactionNetwork` to device.
+
+    Args:
+        reactions (dict): reactions with the batched reaction graph as `graph` and the
+            gather indices (and graphs) as `index`.
+        device (torch.device or int): the device to move to.
+        non_blocking (bool): whether to use asynchronous copy, which only takes effect
+            for tensors in pinned memory.
+
+    Returns:
+        dict: reactions on device.
+    """
+    index = {
+        nt: {k: v.to(device, non_blocking=non_blocking) for k, v in idx.items()}
+        for nt, idx in reactions["index"].items()
+    }
+    graph = reactions["graph"].to(device, non_blocking=non_blocking)
+
+    return {"graph": graph, "index": index}
+
+
+class CUDAPrefetcher:
+    """
+    Wrap a :class:`DataLoaderReactionNetwork` to copy the next batch to a CUDA device
+    on a side stream, while the current batch is used on the current stream.
+
+    Iterating over it yields `(batched_graph, label)` as the data loader does, with
+    the graph, the tensors in `label` and `label["reaction"]` already on the device.
+    The copy only overlaps with compute if the data loader uses pinned memory.
+
+    Args:
+        data_loader (DataLoaderReactionNetwork): the data loader to wrap.
+        device (torch.device or int): the CUDA device to move the batches to.
+    """
+
+    def __init__(self, data_loader, device):
+        self.data_loader = data_loader
+        self.device = torch.device(device)
+
+    def __len__(self):
+        return len(self.data_loader)
+
+    def __iter__(self):
+        stream = torch.cuda.Stream(self.device)
+        batches = iter(self.data_loader)
+
+        next_batch = self._preload(batches, stream)
+        while next_batch is not None:
+            current_stream = torch.cuda.current_stream(self.device)
+            current_stream.wait_stream(stream)
+            batch = next_batch
+
+            # memory allocated on the side stream should not be reused before the
+            # current stream is done with it
+            self._record_stream(batch, current_stream)
+
+            next_batch = self._preload(batches, stream)
+            yield batch
+
+    def _preload(self, batches, stream):
+        try:
+            bg, label = next(batches)
+        except StopIteration:
+            return None
+
+        with torch.cuda.stream(stream):
+            bg = bg.to(self.device, non_blocking=True)
+            label = {
+                k: v.to(self.device, non_blocking=True)
+                if isinstance(v, torch.Tensor)
+                else v
+                for k, v in label.items()
+            }
+            label["reaction"] = reactions_to_device(
+                label["reaction"], self.device, non_blocking=True
+            )
+
+        return bg, label
+
+    @staticmethod
+    def _record_stream(batch, stream):
+        bg, label = batch
+        bg.record_stream(stream)
+        for k, v in label.items():
+            if k == "reaction":
+                v["graph"].record_stream(stream)
+                for idx in v["index"].values():
+                    for x in idx.values():
+                        x.record_stream(stream)
+            elif isinstance(v, torch.Tensor):
+                v.record_stream(stream)
@@ -42,9 +42,10 @@ class BaseDataset:
         Then MAE is |y^-y| = |y'^ - y'| *std(y), i.e. we just need to multiple
         standard deviation to get back to the original scale. Similar analysis
         applies to RMSE.
-    state_dict_filename (str or None): If `None`, feature mean and std (if
+    state_dict_filename (str, dict or None): If `None`, feature mean and std (if
         feature_transformer is True) and label mean and std (if label_transformer is True)
-        are computed from the dataset; otherwise, they are read from the file.
+        are computed from the dataset; otherwise, they are read from the file, or taken
+        from the dict if it is an already loaded state dict.
     """
 
     def __init__(
@@ -87,6 +88,8 @@ class BaseDataset:
         self._label_scaler_std = None
         self._species = None
         self._failed = None
+        self._success_indices = None
+        self.n_total = None
 
         self._load()
 
@@ -138,6 +141,18 @@ class BaseDataset:
         """
         return self._failed
 
+    @property
+    def success_indices(self):
+        """
+        Indices of the entries that do not fail (see `failed`).
+
+        Returns:
+            1D array: indices of the successful entries, in increasing order. Entry i
+                of the dataset corresponds to the `success_indices[i]`-th label.
+            None: is this info is not set
+        """
+        return self._success_indices
+
     def state_dict(self):
         d = {
             "feature_size": self._feature_size,
@@ -164,6 +179,13 @@ class BaseDataset:
         """Read data from files and then featurize."""
         raise NotImplementedError
 
+    @staticmethod
+    def get_state_dict(state_dict):
+        if not isinstance(state_dict, dict):
+            logger.info(f"Load dataset state dict from: {state_dict}")
+            state_dict = torch.load(str(state_dict))
+        return state_dict
+
     @staticmethod
     def get_molecules(molecules):
         if isinstance(molecules, Path):
@@ -247,8 +269,7 @@ class BondDataset(BaseDataset):
 
         # get state info
         if self.state_dict_filename is not None:
-            logger.info(f"Load dataset state dict from: {self.state_dict_filename}")
-            state_dict = torch.load(str(self.state_dict_filename))
+            state_dict = self.get_state_dict(self.state_dict_filename)
             self.load_state_dict(state_dict)
 
         # get species
@@ -278,6 +299,8 @@ class BondDataset(BaseDataset):
                     lb[k] = v
                 self.labels.append(lb)
                 self._failed.append(False)
+        self._success_indices = np.flatnonzero(~np.asarray(self._failed, dtype=bool))
+        self.n_total = len(self._failed)
 
         # this should be called after grapher.build_graph_and_featurize,
         # which initializes the feature name and size
@@ -748,8 +771,7 @@ class ReactionNetworkDataset(BaseDataset):
 
         # get state info
         if self.state_dict_filename is not None:
-            logger.info(f"Load dataset state dict from: {self.state_dict_filename}")
-            state_dict = torch.load(str(self.state_dict_filename))
+            state_dict = self.get_state_dict(self.state_dict_filename)
             self.load_state_dict(state_dict)
 
         # get species
@@ -805,12 +827,13 @@ class ReactionNetworkDataset(BaseDataset):
         reactions = []
         self.labels = []
         self._failed = []
+        graphs_not_none_set = set(graphs_not_none_indices)
         for i, lb in enumerate(raw_labels):
             mol_ids = lb["reactants"] + lb["products"]
 
             for d in mol_ids:
                 # ignore reaction whose reactants or products molecule is None
-                if d not in graphs_not_none_indices:
+                if d not in graphs_not_none_set:
                     self._failed.append(True)
                     break
             else:
@@ -821,6 +844,9 @@ class ReactionNetworkDataset(BaseDataset):
                     bond_mapping=lb["bond_mapping"],
                     id=lb["id"],
                 )
+                # precompute the reaction part of the gather index once here (in the
+                # main process), instead of in every batch (in the dataloader workers)
+                rxn.precompute_product_index()
                 reactions.append(rxn)
                 if "environment" in lb:
                     environemnt = lb["environment"]
@@ -834,6 +860,8 @@ class ReactionNetworkDataset(BaseDataset):
                 self.labels.append(label)
 
                 self._failed.append(False)
+        self._success_indices = np.flatnonzero(~np.asarray(self._failed, dtype=bool))
+        self.n_total = len(self._failed)
 
         self.reaction_ids = list(range(len(reactions)))
 
@@ -5,6 +5,7 @@ Featurize a molecule heterograph of atom, bond, and global nodes with RDkit.
 import torch
 import os
 import warnings
+import functools
 import itertools
 from collections import defaultdict
 import numpy as np
@@ -14,6 +15,17 @@ from rdkit import RDConfig
 from rdkit.Chem.rdchem import GetPeriodicTable
 
 
+@functools.lru_cache(maxsize=None)
+def _get_feature_factory():
+    """
+    RDKit feature factory to find donor and acceptor atoms. Parsing the feature
+    definition file takes a few ms, so it is done once and the factory is shared by
+    all calls of the featurizers.
+    """
+    fdef_name = os.path.join(RDConfig.RDDataDir, "BaseFeatures.fdef")
+    return ChemicalFeatures.BuildFeatureFactory(fdef_name)
+
+
 class BaseFeaturizer:
     def __init__(self, dtype="float32"):
         if dtype not in ["float32", "float64"]:
@@ -597,8 +609,7 @@ class AtomFeaturizerFull(BaseFeaturizer):
         is_donor = defaultdict(int)
         is_acceptor = defaultdict(int)
 
-        fdef_name = os.path.join(RDConfig.RDDataDir, "BaseFeatures.fdef")
-        mol_featurizer = ChemicalFeatures.BuildFeatureFactory(fdef_name)
+        mol_featurizer = _get_feature_factory()
         mol_feats = mol_featurizer.GetFeaturesForMol(mol)
 
         for i in range(len(mol_feats)):
@@ -713,8 +724,7 @@ class AtomFeaturizerMechanism(BaseFeaturizer):
         is_donor = defaultdict(int)
         is_acceptor = defaultdict(int)
 
-        fdef_name = os.path.join(RDConfig.RDDataDir, "BaseFeatures.fdef")
-        mol_featurizer = ChemicalFeatures.BuildFeatureFactory(fdef_name)
+        mol_featurizer = _get_feature_factory()
         mol_feats = mol_featurizer.GetFeaturesForMol(mol)
 
         for i in range(len(mol_feats)):
@@ -38,6 +38,7 @@ class ReactionInNetwork:
 
         self._atom_mapping_list = None
         self._bond_mapping_list = None
+        self._product_index = None
 
     @property
     def init_reactants(self):
@@ -81,6 +82,47 @@ class ReactionInNetwork:
             self._bond_mapping_list = self._mapping_as_list(self.bond_mapping, "bond")
         return self._bond_mapping_list
 
+    @property
+    def product_index(self):
+        """
+        For each atom (bond) in the reactant, the corresponding product and the atom
+        (bond) in it.
+
+        Returns:
+            dict: {nt: (mol, node)}, where nt is `atom` or `bond`. `mol` is a 1D
+            int64 array of the position of the product in `products` and `node` is a
+            1D int64 array of the index of the atom (bond) in the product. For the
+            broken bond, `mol` is -1 (and `node` is 0).
+        """
+        if self._product_index is None:
+            self.precompute_product_index()
+        return self._product_index
+
+    def precompute_product_index(self):
+        """
+        Compute `product_index` and store it, such that it can be done once when
+        creating the dataset instead of in every batch.
+        """
+        self._product_index = {}
+        for nt, mappings, mp_list in [
+            ("atom", self.atom_mapping, self.atom_mapping_as_list),
+            ("bond", self.bond_mapping, self.bond_mapping_as_list),
+        ]:
+            # each mapping maps all atoms (bonds) in a product; products without
+            # bonds have an empty bond mapping and thus are excluded
+            sizes = np.asarray([len(mp) for mp in mappings], dtype=np.int64)
+            mol = np.repeat(np.arange(len(sizes), dtype=np.int64), sizes)
+            node = np.arange(len(mol), dtype=np.int64) - np.repeat(
+                np.cumsum(sizes) - sizes, sizes
+            )
+
+            # the broken bond is the last one in the products (see _mapping_as_list)
+            if nt == "bond":
+                mol = np.append(mol, -1)
+                node = np.append(node, 0)
+
+            self._product_index[nt] = (mol[mp_list], node[mp_list])
+
     @staticmethod
     def _mapping_as_list(mappings, mode="atom"):
         """
@@ -254,3 +296,102 @@ class ReactionNetwork:
         sub_molecules = [self.molecules[i] for i in ids]
 
         return sub_reactions, sub_molecules
+
+
+def reaction_gather_index(reactions, sizes_atom, sizes_bond):
+    """
+    Create the indices to gather features from a batched molecule graph to build the
+    features of the corresponding batched reaction graph.
+
+    A reaction graph has the same graph structure as its reactant, and its features
+    are the difference between the products features and the reactant features. So,
+    for each node type, the reaction features can be obtained by:
+
+    feats[nt][index[nt]["product"]] - feats[nt][index[nt]["reactant"]]
+
+    except for `global`, where the product features are summed over all the products
+    of a reaction given by `index["global"]["segment"]`.
+
+    The reaction specific part is precomputed by `ReactionInNetwork.product_index`,
+    so here only the offsets of the molecules in the batch are added.
+
+    Note:
+        This assumes there is only one reactant in each reaction and one bond broken.
+
+    Args:
+        reactions (list): a sequence of :class:`ReactionInNetwork`, with `reactants`
+            and `products` given as indices of molecules in the batch.
+        sizes_atom (list): number of atoms of each molecule in the batch.
+        sizes_bond (list): number of bonds of each molecule in the batch.
+
+    Returns:
+        dict: {nt: {"reactant": idx, "product": idx}}, where nt is `atom`, `bond` and
+            `global` and idx is a 1D int64 array. In addition, for `bond`,
+            an int64 array `broken` is given, which are the positions of the broken
+            bonds (the product features of which should be zero); and for `global`,
+            an int64 array `segment` is given, mapping each product to its reaction.
+    """
+    for rxn in reactions:
+        assert (
+            len(rxn.reactants) == 1
+        ), f"number of reactants ({len(rxn.reactants)}) not supported"
+
+    num_rxns = len(reactions)
+    reactants = np.asarray([rxn.reactants[0] for rxn in reactions], dtype=np.int64)
+    num_products = np.asarray([len(rxn.products) for rxn in reactions], dtype=np.int64)
+    products = np.concatenate([rxn.products for rxn in reactions]).astype(np.int64)
+    products_start = np.cumsum(num_products) - num_products
+
+    index = {}
+    for nt, sizes in [("atom", sizes_atom), ("bond", sizes_bond)]:
+        sizes = np.asarray(sizes, dtype=np.int64)
+        offset = np.cumsum(sizes) - sizes
+
+        # reactant: all nodes of the reactant molecule in order
+        reactant_idx = _concatenate_ranges(offset[reactants], sizes[reactants])
+
+        # products: reordered such that nodes have the same order as the reactant
+        mol, node = zip(*[rxn.product_index[nt] for rxn in reactions])
+        counts = [len(x) for x in mol]
+        mol = np.concatenate(mol)
+        node = np.concatenate(node)
+        assert len(mol) == len(reactant_idx), (
+            f"products {nt} ({len(mol)}) and reactant {nt} ({len(reactant_idx)}) "
+            f"have different length"
+        )
+
+        # broken bond uses the zero feature; point it to a valid index and record it
+        broken = np.flatnonzero(mol < 0)
+        mol[broken] = 0
+
+        rxn_of_node = np.repeat(np.arange(num_rxns), counts)
+        product_idx = offset[products[products_start[rxn_of_node] + mol]] + node
+        product_idx[broken] = 0
+
+        index[nt] = {"reactant": reactant_idx, "product": product_idx}
+        if nt == "bond":
+            index[nt]["broken"] = broken
+
+    # global: each molecule has one global node
+    index["global"] = {
+        "reactant": reactants,
+        "product": products,
+        "segment": np.repeat(np.arange(num_rxns, dtype=np.int64), num_products),
+    }
+
+    return index
+
+
+def _concatenate_ranges(starts, lengths):
+    """
+    Concatenate ranges, each given by `start` and `length`.
+
+    Example:
+        >>> _concatenate_ranges([0, 5], [3, 2])
+        >>> [0, 1, 2, 5, 6]
+    """
+    starts = np.asarray(starts, dtype=np.int64)
+    lengths = np.asarray(lengths, dtype=np.int64)
+    shift = np.repeat(starts - (np.cumsum(lengths) - lengths), lengths)
+
+    return np.arange(lengths.sum(), dtype=np.int64) + shift
@@ -176,7 +176,10 @@ class Set2Set(nn.Module):
             The output feature with shape :math:`(B, D)`, where :math:`B` refers to
             the batch size, and :math:`D` means the size of features.
         """
-        with graph.local_scope():
+        # the LSTM and the softmax over nodes are sensitive to reduced precision, so
+        # set2set always runs in the precision of the LSTM, also under autocast
+        with graph.local_scope(), torch.autocast(feat.device.type, enabled=False):
+            feat = feat.to(self.lstm.weight_ih_l0.dtype)
             batch_size = graph.batch_size
 
             h = (
@@ -268,3 +271,73 @@ class Set2SetThenCat(nn.Module):
         res = torch.cat(rst, dim=-1)  # dim=-1 to deal with batched graph
 
         return res
+
+
+class SegmentReduceThenCat(nn.Module):
+    """
+    Sum (or mean) of the features of the nodes (separate for different node type) in
+    each graph and then concatenate the features of different node types to create a
+    representation of the graph.
+
+    This is a cheaper alternative to :class:`Set2SetThenCat`, without the LSTM.
+
+     Args:
+        ntypes: node types to reduce, e.g. ['atom', 'bond']
+        ntypes_direct_cat: node types to which not perform the reduction, whose
+            feature is directly concatenated. e.g. ['global']
+        reducer: `sum` or `mean`.
+    """
+
+    def __init__(
+        self,
+        ntypes: List[str],
+        ntypes_direct_cat: Optional[List[str]] = None,
+        reducer: str = "sum",
+    ):
+        super(SegmentReduceThenCat, self).__init__()
+        if reducer not in ["sum", "mean"]:
+            raise ValueError(f"Expect reducer to be `sum` or `mean`; got {reducer}")
+
+        self.ntypes = ntypes
+        self.ntypes_direct_cat = ntypes_direct_cat
+        self.reducer = reducer
+
+    def forward(
+        self, graph: dgl.DGLGraph, feats: Dict[str, torch.Tensor]
+    ) -> torch.Tensor:
+        """
+        Args:
+            graph: the graph
+            feats: node features with node type as key and the corresponding
+                features as value. Each tensor is of shape (N, D) where N is the number
+                of nodes of the corresponding node type, and D is the feature size.
+        Returns:
+            graph representation of shape (B, D), where B is the batch size and D is
+                the sum of the feature sizes of all node types.
+        """
+        rst = []
+        for nt in self.ntypes:
+            feat = feats[nt]
+            num_nodes = graph.batch_num_nodes(nt)
+
+            # DGL has no bfloat16 segment reduce kernel on CPU, and summing over many
+            # nodes loses precision in reduced precision, so reduce those in float32
+            reduced_precision = feat.dtype in (torch.float16, torch.bfloat16)
+            with torch.autocast(feat.device.type, enabled=False):
+                ft = feat.float() if reduced_precision else feat
+                ft = dgl.ops.segment_reduce(num_nodes, ft, "sum")
+                if self.reducer == "mean":
+                    # graphs without nodes of the type (e.g. no bonds) get zero
+                    ft = ft / num_nodes.clamp(min=1).to(ft.dtype).view(-1, 1)
+            rst.append(ft.to(feat.dtype))
+
+        if self.ntypes_direct_cat is not None:
+            for nt in self.ntypes_direct_cat:
+                rst.append(feats[nt])
+
+        res = torch.cat(rst, dim=-1)  # dim=-1 to deal with batched graph
+
+        return res
+
+    def extra_repr(self):
+        return f"reducer={self.reducer}"
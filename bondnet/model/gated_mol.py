@@ -1,8 +1,9 @@
 import logging
+import torch
 import torch.nn as nn
 from bondnet.layer.gatedconv import GatedGCNConv, GatedGCNConv1, GatedGCNConv2
-from bondnet.layer.readout import Set2SetThenCat
-from bondnet.layer.utils import UnifySize
+from bondnet.layer.readout import Set2SetThenCat, SegmentReduceThenCat
+from bondnet.layer.utils import UnifySize, LinearN
 
 logger = logging.getLogger(__name__)
 
@@ -28,6 +29,9 @@ class GatedGCNMol(nn.Module):
         gated_activation (torch activation): activation fn of gated layers
         gated_residual (bool, optional): [description]. Defaults to False.
         gated_dropout (float, optional): dropout ratio for gated layer.
+        readout (str): readout layer, `set2set` for :class:`Set2SetThenCat`, or `sum`
+            or `mean` for :class:`SegmentReduceThenCat` with the reducer. For
+            `sum` and `mean`, `num_lstm_iters` and `num_lstm_layers` are ignored.
         fc_num_layers (int): number of fc layers. Note this is the number of hidden
             layers, i.e. there is an additional fc layer to map feature size to 1.
         fc_hidden_size (list): hidden size of fc layers
@@ -60,6 +64,7 @@ class GatedGCNMol(nn.Module):
         fc_dropout=0.0,
         outdim=1,
         conv="GatedGCNConv",
+        readout="set2set",
     ):
         super(GatedGCNMol, self).__init__()
 
@@ -98,21 +103,32 @@ class GatedGCNMol(nn.Module):
             )
             in_size = gated_hidden_size[i]
 
-        # set2set readout layer
+        # readout layer
         ntypes = ["atom", "bond"]
         in_size = [gated_hidden_size[-1]] * len(ntypes)
 
-        self.readout_layer = Set2SetThenCat(
-            n_iters=num_lstm_iters,
-            n_layer=num_lstm_layers,
-            ntypes=ntypes,
-            in_feats=in_size,
-            ntypes_direct_cat=set2set_ntypes_direct,
-        )
-
-        # for atom and bond feat (# *2 because Set2Set used in Set2SetThenCat has out
-        # feature twice the the size  of in feature)
-        readout_out_size = gated_hidden_size[-1] * 2 + gated_hidden_size[-1] * 2
+        if readout == "set2set":
+            self.readout_layer = Set2SetThenCat(
+                n_iters=num_lstm_iters,
+                n_layer=num_lstm_layers,
+                ntypes=ntypes,
+                in_feats=in_size,
+                ntypes_direct_cat=set2set_ntypes_direct,
+            )
+
+            # for atom and bond feat (# *2 because Set2Set used in Set2SetThenCat has
+            # out feature twice the the size  of in feature)
+            readout_out_size = gated_hidden_size[-1] * 2 + gated_hidden_size[-1] * 2
+
+        elif readout in ["sum", "mean"]:
+            self.readout_layer = SegmentReduceThenCat(
+                ntypes=ntypes, ntypes_direct_cat=set2set_ntypes_direct, reducer=readout
+            )
+            readout_out_size = gated_hidden_size[-1] * len(ntypes)
+
+        else:
+            raise ValueError(f"Unsupported readout {readout}")
+
         # for global feat
         if set2set_ntypes_direct is not None:
             readout_out_size += gated_hidden_size[-1] * len(set2set_ntypes_direct)
@@ -144,6 +160,13 @@ class GatedGCNMol(nn.Module):
         # final output layer, mapping feature to the corresponding shape
         self.fc_layers.append(nn.Linear(in_size, outdim))
 
+        # fc layers captured in CUDA graphs, with (input shape, grad mode, train mode)
+        # as key (plain dict such that they are not registered as submodules)
+        self._graphed_fc_layers = {}
+
+        # fc layers compiled by torch.compile, see `compile_dense_layers()`
+        self._compiled_fc_forward = None
+
     def forward(self, graph, feats, norm_atom, norm_bond):
         """
         Args:
@@ -166,7 +189,124 @@ class GatedGCNMol(nn.Module):
         feats = self.readout_layer(graph, feats)
 
         # fc
+        feats = self.fc_forward(feats)
+
+        return feats
+
+    def fc_forward(self, feats):
+        """
+        Apply the fc layers, using the CUDA graph captured by
+        :meth:`capture_fc_layers` if there is one for the shape of `feats` and the
+        current grad mode and train/eval mode.
+
+        Args:
+            feats (2D tensor): of shape (N, D), output of the readout layer.
+
+        Returns:
+            2D tensor: of shape (N, outdim)
+        """
+        key = (tuple(feats.shape), torch.is_grad_enabled(), self.training)
+        graphed = self._graphed_fc_layers.get(key)
+        if graphed is not None:
+            return graphed(feats)
+
+        if self._compiled_fc_forward is not None:
+            return self._compiled_fc_forward(feats)
+
+        return self._fc_forward_eager(feats)
+
+    def _fc_forward_eager(self, feats):
         for layer in self.fc_layers:
             feats = layer(feats)
 
         return feats
+
+    def compile_dense_layers(self, **kwargs):
+        """
+        Compile, with `torch.compile`, the parts of the model that only operate on
+        dense tensors: the embedding layer, the fc layers (phi's) inside the gated
+        layers, and the final fc layers.
+
+        DGL message passing and the set2set readout are left eager, because they act
+        on (batched) DGL graphs that the compiler cannot trace and would graph break
+        on. Submodules are compiled in place, so parameter names and thus checkpoints
+        are not affected.
+
+        Args:
+            kwargs: keyword arguments passed to `torch.compile`, e.g. `mode` and
+                `dynamic`. Since the number of atoms and bonds changes from batch to
+                batch, `dynamic=True` avoids recompiling for each new shape.
+        """
+        self.embedding.compile(**kwargs)
+        for layer in self.gated_layers:
+            for m in layer.children():
+                if isinstance(m, LinearN):
+                    m.compile(**kwargs)
+        self._compiled_fc_forward = torch.compile(self._fc_forward_eager, **kwargs)
+
+    def capture_fc_layers(self, batch_size, inference=False):
+        """
+        Capture the forward and backward of the fc layers in CUDA graphs for inputs
+        of `batch_size` graphs, which removes their (many small) kernel launches for
+        training. With `inference=True`, only the forward is captured, to be used with
+        grad disabled (e.g. in `torch.no_grad()` or `torch.inference_mode()`).
+
+        The gated and readout layers are not captured, because DGL message passing
+        depends on the batched graph structure, which differs from batch to batch.
+        The fc layers have a fixed input shape as long as the batch size is fixed,
+        and the last batch of a different size uses the eager fc layers.
+
+        The model should be on GPU and in the mode (train/eval) it will be used.
+
+        Args:
+            batch_size (int): number of graphs in a batch.
+            inference (bool): whether to capture the forward only, for inference.
+        """
+        fc_layers = nn.Sequential(*self.fc_layers)
+        p = next(fc_layers.parameters())
+        shape = (batch_size, self.fc_layers[0].in_features)
+
+        # running stats of batch norm are updated in warmup; restore them
+        buffers = [b.clone() for b in fc_layers.buffers()]
+        if inference:
+            graphed = _capture_inference(fc_layers, shape, p.device)
+        else:
+            sample = torch.randn(shape, device=p.device, requires_grad=True)
+            graphed = torch.cuda.make_graphed_callables(fc_layers, (sample,))
+        with torch.no_grad():
+            for b, saved in zip(fc_layers.buffers(), buffers):
+                b.copy_(saved)
+
+        self._graphed_fc_layers[(shape, not inference, self.training)] = graphed
+
+
+def _capture_inference(module, shape, device, num_warmup=3):
+    """
+    Capture the forward of `module` for input of `shape` in a CUDA graph, without
+    autograd.
+
+    Returns:
+        callable: it copies its input into the static input of the graph, replays the
+            graph, and returns a copy of the static output, so that the result is not
+            overwritten by the next call.
+    """
+    static_input = torch.zeros(shape, device=device)
+
+    # warm up on a side stream, as required before capturing
+    stream = torch.cuda.Stream(device)
+    stream.wait_stream(torch.cuda.current_stream(device))
+    with torch.cuda.stream(stream), torch.no_grad():
+        for _ in range(num_warmup):
+            module(static_input)
+    torch.cuda.current_stream(device).wait_stream(stream)
+
+    graph = torch.cuda.CUDAGraph()
+    with torch.cuda.graph(graph), torch.no_grad():
+        static_output = module(static_input)
+
+    def graphed(x):
+        static_input.copy_(x)
+        graph.replay()
+        return static_output.clone()
+
+    return graphed
@@ -1,3 +1,5 @@
+import argparse
+import functools
 import torch
 import yaml
 import bondnet
@@ -21,7 +23,6 @@ from bondnet.core.rdmol import read_rdkit_mols_from_file
 from bondnet.data.utils import get_dataset_species
 from bondnet.prediction.google_drive import download_file_from_google_drive
 from bondnet.utils import (
-    load_checkpoints,
     check_exists,
     to_path,
     yaml_load,
@@ -111,11 +112,7 @@ def get_model_info(model_path):
 
 
 def load_model(model_path, pretrained=True):
-
-    # NOTE cannot use bondnet.utils.yaml_load, which uses the safe_loader.
-    # see: https://github.com/yaml/pyyaml/issues/266
-    with open(model_path.joinpath("train_args.yaml"), "r") as f:
-        model_args = yaml.load(f, Loader=yaml.Loader)
+    model_args = _load_train_args(model_path)
 
     model = GatedGCNReactionNetwork(
         in_feats=model_args.feature_size,
@@ -138,18 +135,63 @@ def load_model(model_path, pretrained=True):
         fc_dropout=model_args.fc_dropout,
         outdim=1,
         conv="GatedGCNConv",
+        # models trained before the readout option was added use set2set
+        readout=getattr(model_args, "readout", "set2set"),
     )
 
     if pretrained:
-        load_checkpoints(
-            {"model": model},
-            map_location=torch.device("cuda:0"),
-            filename=model_path.joinpath("checkpoint.pkl"),
-        )
+        # the cached state dict is copied into the parameters, so models returned by
+        # different calls do not share tensors
+        model.load_state_dict(_load_model_state_dict(model_path))
 
     return model
 
 
+class _TrainArgsLoader(getattr(yaml, "CSafeLoader", yaml.SafeLoader)):
+    """
+    Safe yaml loader, using libyaml if available, that can also construct the
+    `argparse.Namespace` of the training arguments stored in `train_args.yaml`.
+    """
+
+
+def _construct_namespace(loader, node):
+    return argparse.Namespace(**loader.construct_mapping(node, deep=True))
+
+
+_TrainArgsLoader.add_constructor(
+    "tag:yaml.org,2002:python/object:argparse.Namespace", _construct_namespace
+)
+
+
+# The train args, checkpoint, dataset state dict and grapher of a model do not change
+# between calls, so they are cached to avoid re-reading them from disk for each
+# prediction. The model itself is not cached, because the caller may move or compile it.
+@functools.lru_cache(maxsize=None)
+def _load_train_args(model_path):
+    # NOTE cannot use bondnet.utils.yaml_load, since the plain safe loader does not
+    # know how to construct the stored argparse.Namespace.
+    # see: https://github.com/yaml/pyyaml/issues/266
+    with open(model_path.joinpath("train_args.yaml"), "r") as f:
+        model_args = yaml.load(f, Loader=_TrainArgsLoader)
+
+    return model_args
+
+
+@functools.lru_cache(maxsize=None)
+def _load_model_state_dict(model_path):
+    # load to CPU; the caller moves the model to the device to use
+    checkpoints = torch.load(
+        str(model_path.joinpath("checkpoint.pkl")), map_location=torch.device("cpu")
+    )
+
+    return checkpoints["model"]
+
+
+@functools.lru_cache(maxsize=None)
+def _load_dataset_state_dict(model_path):
+    return torch.load(str(model_path.joinpath("dataset_state_dict.pkl")))
+
+
 def load_dataset(model_path, molecules, labels, extra_features):
 
     # NOTE inplace fix for the mg_thf_g2 featurizer (see _get_grapher()), which needs
@@ -177,8 +219,8 @@ def load_dataset(model_path, molecules, labels, extra_features):
                     if "environment" not in x:
                         x["environment"] = env_map[env]
 
-    state_dict_filename = model_path.joinpath("dataset_state_dict.pkl")
-    _check_species(molecules, state_dict_filename)
+    state_dict = _load_dataset_state_dict(model_path)
+    _check_species(molecules, state_dict["species"])
     _check_charge(model_path, extra_features)
 
     dataset = ReactionNetworkDataset(
@@ -188,13 +230,13 @@ def load_dataset(model_path, molecules, labels, extra_features):
         extra_features=extra_features,
         feature_transformer=True,
         label_transformer=True,
-        state_dict_filename=state_dict_filename,
+        state_dict_filename=state_dict,
     )
 
     return dataset
 
 
-def _check_species(molecules, state_dict_filename):
+def _check_species(molecules, supported_species):
     if isinstance(molecules, (str, Path)):
         check_exists(molecules)
         mols = read_rdkit_mols_from_file(molecules)
@@ -202,11 +244,7 @@ def _check_species(molecules, state_dict_filename):
         mols = molecules
 
     species = get_dataset_species(mols)
-    
-    # print(torch.load(str(state_dict_filename)))
-
 
-    supported_species = torch.load(str(state_dict_filename))["species"]
     not_supported = []
     for s in species:
         if s not in supported_species:
@@ -242,6 +280,7 @@ def _check_charge(model_path, features):
         )
 
 
+@functools.lru_cache(maxsize=None)
 def _get_grapher(model_path):
     model_info = get_model_info(model_path)
     allowed_charge = model_info["allowed_charge"]
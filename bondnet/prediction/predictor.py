@@ -1,6 +1,11 @@
+import warnings
 import numpy as np
 import torch
-from bondnet.data.dataloader import DataLoaderReactionNetwork
+from bondnet.data.dataloader import (
+    CUDAPrefetcher,
+    DataLoaderReactionNetwork,
+    reactions_to_device,
+)
 from bondnet.prediction.io import (
     PredictionByReaction,
     PredictionMultiReactant,
@@ -26,7 +31,12 @@ def predict_single_molecule(
     figure_name="prediction.png",
     format=None,
     # output='dict',
-    output=None
+    output=None,
+    device=None,
+    compile_model=False,
+    amp=False,
+    num_workers=0,
+    cuda_graph=False,
 ):
     """
     Make predictions for a single molecule.
@@ -49,6 +59,12 @@ def predict_single_molecule(
         figure_name (str): the name of the figure to be created showing the bond energy.
         format (str): format of the molecule, if not provided, will guess based on the
             file extension.
+        device (str): device to run the model on; see `get_prediction()`.
+        compile_model (bool): whether to compile the model; see `get_prediction()`.
+        amp (bool): whether to use bfloat16 autocast; see `get_prediction()`.
+        num_workers (int): number of batch collating workers; see `get_prediction()`.
+        cuda_graph (bool): whether to run the fc layers in a CUDA graph; see
+            `get_prediction()`.
 
     Returns:
         str: sdf string representing the molecules and energies.
@@ -63,26 +79,7 @@ def predict_single_molecule(
         charge in allowed_charge
     ), f"expect charge to be one of {allowed_charge}, but got {charge}"
 
-    p = to_path(molecule)
-    if p.is_file():
-        if format is None:
-            suffix = p.suffix.lower()
-            if suffix == ".sdf":
-                format = "sdf"
-            elif suffix == ".pdb":
-                format = "pdb"
-            else:
-                raise RuntimeError(
-                    f"Expect file format `.sdf` or `.pdb`, but got {suffix}"
-                )
-        with open(p, "r") as f:
-            molecule = f.read().strip()
-    else:
-        if format is None:
-            if molecule.lower().startswith("inchi="):
-                format = "inchi"
-            else:
-                format = "smiles"
+    molecule, format = _read_molecule(molecule, format)
 
     predictor = PredictionOneReactant(
         molecule, charge, format, allowed_charge, ring_bond, one_per_iso_bond_group
@@ -90,7 +87,16 @@ def predict_single_molecule(
 
     molecules, labels, extra_features = predictor.prepare_data()
     predictions = get_prediction(
-        model_path, unit_converter, molecules, labels, extra_features
+        model_path,
+        unit_converter,
+        molecules,
+        labels,
+        extra_features,
+        device=device,
+        compile_model=compile_model,
+        amp=amp,
+        num_workers=num_workers,
+        cuda_graph=cuda_graph,
     )
 
     if output == 'dict':
@@ -98,6 +104,114 @@ def predict_single_molecule(
     return predictor.write_results(predictions, figure_name, write_result)
 
 
+def predict_molecules(
+    model_name,
+    molecules,
+    charges=None,
+    ring_bond=True,
+    one_per_iso_bond_group=True,
+    format=None,
+    device=None,
+    compile_model=False,
+    amp=False,
+    num_workers=0,
+    cuda_graph=False,
+):
+    """
+    Make predictions for all bonds of a list of molecules.
+
+    This is equivalent to calling `predict_single_molecule(..., output="dict")` for
+    each molecule, but the model is run only once on the bonds of all the molecules,
+    which are batched together.
+
+    Args:
+        model_name (str): The pre-trained model to use for making predictions. See
+            `predict_single_molecule()`.
+        molecules (list): SMILES or InChI strings or paths to files storing these
+            strings.
+        charges (list): charges of the molecules. If `None`, all are set to zero.
+        ring_bond (bool): whether to make predictions for ring bond.
+        one_per_iso_bond_group (bool): If `True`, keep one reaction for each
+            isomorphic bond group (fragments obtained by breaking different bond
+            are isomorphic to each other). If `False`, keep all.
+        format (str): format of the molecules, if not provided, will guess based on
+            the file extension or string for each molecule.
+        device (str): device to run the model on; see `get_prediction()`.
+        compile_model (bool): whether to compile the model; see `get_prediction()`.
+        amp (bool): whether to use bfloat16 autocast; see `get_prediction()`.
+        num_workers (int): number of batch collating workers; see `get_prediction()`.
+        cuda_graph (bool): whether to run the fc layers in a CUDA graph; see
+            `get_prediction()`.
+
+    Returns:
+        list: {bond: energy} dict for each molecule, where energy is `None` for bonds
+            that are not predicted.
+    """
+
+    model_path = get_model_path(model_name)
+    model_info = get_model_info(model_path)
+    allowed_charge = model_info["allowed_charge"]
+    unit_converter = model_info["unit_conversion"]
+
+    if charges is None:
+        charges = [0] * len(molecules)
+    assert len(charges) == len(molecules), (
+        f"expect the same number of molecules and charges, but got {len(molecules)} "
+        f"and {len(charges)}"
+    )
+
+    predictors = []
+    for mol, charge in zip(molecules, charges):
+        assert (
+            charge in allowed_charge
+        ), f"expect charge to be one of {allowed_charge}, but got {charge}"
+
+        mol, fmt = _read_molecule(mol, format)
+        predictors.append(
+            PredictionOneReactant(
+                mol, charge, fmt, allowed_charge, ring_bond, one_per_iso_bond_group
+            )
+        )
+
+    # concatenate the data of all molecules, shifting the molecule indices of the
+    # reactions by the number of molecules before them
+    all_molecules = []
+    all_labels = []
+    all_extra_features = []
+    num_reactions = []
+    for predictor in predictors:
+        mols, labels, extra_features = predictor.prepare_data()
+        for lb in labels:
+            lb["reactants"] = [i + len(all_molecules) for i in lb["reactants"]]
+            lb["products"] = [i + len(all_molecules) for i in lb["products"]]
+            lb["index"] += len(all_labels)
+        all_molecules.extend(mols)
+        all_labels.extend(labels)
+        all_extra_features.extend(extra_features)
+        num_reactions.append(len(labels))
+
+    predictions = get_prediction(
+        model_path,
+        unit_converter,
+        all_molecules,
+        all_labels,
+        all_extra_features,
+        device=device,
+        compile_model=compile_model,
+        amp=amp,
+        num_workers=num_workers,
+        cuda_graph=cuda_graph,
+    )
+
+    bond_dicts = []
+    start = 0
+    for predictor, n in zip(predictors, num_reactions):
+        bond_dicts.append(predictor.get_bond_dict(predictions[start : start + n]))
+        start += n
+
+    return bond_dicts
+
+
 def predict_multiple_molecules(
     model_name,
     molecule_file,
@@ -106,6 +220,11 @@ def predict_multiple_molecules(
     format,
     ring_bond=False,
     one_per_iso_bond_group=True,
+    device=None,
+    compile_model=False,
+    amp=False,
+    num_workers=0,
+    cuda_graph=False,
 ):
     """
     Make predictions of bond energies of multiple molecules.
@@ -125,6 +244,12 @@ def predict_multiple_molecules(
         one_per_iso_bond_group (bool): If `True`, keep one reaction for each
             isomorphic bond group (fragments obtained by breaking different bond
             are isomorphic to each other). If `False`, keep all.
+        device (str): device to run the model on; see `get_prediction()`.
+        compile_model (bool): whether to compile the model; see `get_prediction()`.
+        amp (bool): whether to use bfloat16 autocast; see `get_prediction()`.
+        num_workers (int): number of batch collating workers; see `get_prediction()`.
+        cuda_graph (bool): whether to run the fc layers in a CUDA graph; see
+            `get_prediction()`.
     """
 
     model_path = get_model_path(model_name)
@@ -142,14 +267,33 @@ def predict_multiple_molecules(
     )
     molecules, labels, extra_features = predictor.prepare_data()
     predictions = get_prediction(
-        model_path, unit_converter, molecules, labels, extra_features
+        model_path,
+        unit_converter,
+        molecules,
+        labels,
+        extra_features,
+        device=device,
+        compile_model=compile_model,
+        amp=amp,
+        num_workers=num_workers,
+        cuda_graph=cuda_graph,
     )
 
     return predictor.write_results(predictions, out_file)
 
 
 def predict_by_reactions(
-    model_name, molecule_file, reaction_file, charge_file, out_file, format
+    model_name,
+    molecule_file,
+    reaction_file,
+    charge_file,
+    out_file,
+    format,
+    device=None,
+    compile_model=False,
+    amp=False,
+    num_workers=0,
+    cuda_graph=False,
 ):
     """
     Make predictions for many bonds where each bond is specified as an reaction.
@@ -165,6 +309,12 @@ def predict_by_reactions(
         out_file (str): path to file to write output
         format (str): format of molecules, e.g. `sdf`, `graph`, `pdb`, `smiles`,
             and `inchi`.
+        device (str): device to run the model on; see `get_prediction()`.
+        compile_model (bool): whether to compile the model; see `get_prediction()`.
+        amp (bool): whether to use bfloat16 autocast; see `get_prediction()`.
+        num_workers (int): number of batch collating workers; see `get_prediction()`.
+        cuda_graph (bool): whether to run the fc layers in a CUDA graph; see
+            `get_prediction()`.
     """
     model_path = get_model_path(model_name)
     model_info = get_model_info(model_path)
@@ -176,14 +326,32 @@ def predict_by_reactions(
 
     molecules, labels, extra_features = predictor.prepare_data()
     predictions = get_prediction(
-        model_path, unit_converter, molecules, labels, extra_features
+        model_path,
+        unit_converter,
+        molecules,
+        labels,
+        extra_features,
+        device=device,
+        compile_model=compile_model,
+        amp=amp,
+        num_workers=num_workers,
+        cuda_graph=cuda_graph,
     )
 
     return predictor.write_results(predictions, out_file)
 
 
 def predict_by_struct_label_extra_feats_files(
-    model_name, molecule_file, label_file, extra_feats_file, out_file="bde.yaml"
+    model_name,
+    molecule_file,
+    label_file,
+    extra_feats_file,
+    out_file="bde.yaml",
+    device=None,
+    compile_model=False,
+    amp=False,
+    num_workers=0,
+    cuda_graph=False,
 ):
     model_path = get_model_path(model_name)
     model_info = get_model_info(model_path)
@@ -195,68 +363,184 @@ def predict_by_struct_label_extra_feats_files(
 
     molecules, labels, extra_features = predictor.prepare_data()
     predictions = get_prediction(
-        model_path, unit_converter, molecules, labels, extra_features
+        model_path,
+        unit_converter,
+        molecules,
+        labels,
+        extra_features,
+        device=device,
+        compile_model=compile_model,
+        amp=amp,
+        num_workers=num_workers,
+        cuda_graph=cuda_graph,
     )
 
     return predictor.write_results(predictions, out_file)
 
 
-def get_prediction(model_path, unit_converter, molecules, labels, extra_features):
+def _read_molecule(molecule, format=None):
+    """
+    Read a molecule given as a string or a path to a file storing the string.
+
+    Returns:
+        molecule (str): string representing the molecule.
+        format (str): format of the molecule string. If `format` is given, it is
+            returned as is; otherwise, it is guessed from the file extension or the
+            string.
+    """
+    p = to_path(molecule)
+    if p.is_file():
+        if format is None:
+            suffix = p.suffix.lower()
+            if suffix == ".sdf":
+                format = "sdf"
+            elif suffix == ".pdb":
+                format = "pdb"
+            else:
+                raise RuntimeError(
+                    f"Expect file format `.sdf` or `.pdb`, but got {suffix}"
+                )
+        with open(p, "r") as f:
+            molecule = f.read().strip()
+    else:
+        if format is None:
+            if molecule.lower().startswith("inchi="):
+                format = "inchi"
+            else:
+                format = "smiles"
+
+    return molecule, format
+
+
+def get_prediction(
+    model_path,
+    unit_converter,
+    molecules,
+    labels,
+    extra_features,
+    device=None,
+    compile_model=False,
+    amp=False,
+    num_workers=0,
+    cuda_graph=False,
+):
+    """
+    Args:
+        device (str or torch.device): device to run the model on. If `None`, use the
+            GPU if one is available and the CPU otherwise.
+        compile_model (bool): whether to compile the dense layers of the model with
+            `torch.compile` (see `GatedGCNMol.compile_dense_layers()`). Compiling
+            takes a while for the first batch, so this pays off only when predicting
+            for many molecules.
+        amp (bool): whether to run the model in bfloat16 autocast. This trades a
+            small loss of precision for speed on hardware with native bfloat16
+            support.
+        num_workers (int): number of worker processes to collate batches in. With the
+            default 0, batches are collated in the main process, which is faster
+            unless there are many batches, since starting workers has a fixed cost.
+        cuda_graph (bool): whether to capture the fc layers of the model in a CUDA
+            graph for full batches (see `GatedGCNMol.capture_fc_layers()`). Only used
+            on CUDA devices. Message passing is not captured, since the structure of
+            the batched graph differs from batch to batch.
+    """
+    if device is None:
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+
+    batch_size = 100
 
     model = load_model(model_path)
-    model = model.to('cuda:0')
+    model = model.to(device)
+    if cuda_graph and torch.device(device).type == "cuda":
+        # capture in the mode the model is used in
+        model.eval()
+        model.capture_fc_layers(batch_size, inference=True)
+    if compile_model:
+        # in-place `nn.Module.compile()` is only available in torch >= 2.2
+        if hasattr(torch.nn.Module, "compile"):
+            model.compile_dense_layers(dynamic=True)
+        else:
+            warnings.warn(
+                f"torch {torch.__version__} does not support compiling modules in "
+                "place. Continue without compiling the model."
+            )
     dataset = load_dataset(model_path, molecules, labels, extra_features)
-    data_loader = DataLoaderReactionNetwork(dataset, batch_size=100, shuffle=False)
+    # pinned memory enables asynchronous host to device copy. The data is iterated
+    # over only once, so workers (if any) are not kept alive.
+    data_loader = DataLoaderReactionNetwork(
+        dataset,
+        batch_size=batch_size,
+        shuffle=False,
+        pin_memory=torch.device(device).type == "cuda",
+        num_workers=num_workers,
+    )
 
     feature_names = ["atom", "bond", "global"]
 
     # evaluate
-    predictions = evaluate(model, feature_names, data_loader)
-
-    # in case some entry fail
-    if len(predictions) != len(dataset.failed):
-        pred = []
-        idx = 0
-        for failed in dataset.failed:
-            if failed:
-                pred.append(None)
-            else:
-                pred.append(predictions[idx] * unit_converter)
-                idx += 1
-        predictions = pred
-    else:
-        predictions = np.asarray(predictions) * unit_converter
+    predictions = evaluate(model, feature_names, data_loader, amp=amp)
+
+    predictions = np.asarray(predictions) * unit_converter
+
+    # in case some entry fail, scatter the predictions to the entries that succeed
+    # and set the failed ones to None
+    if len(predictions) != dataset.n_total:
+        pred = np.full(dataset.n_total, None, dtype=object)
+        pred[dataset.success_indices] = predictions
+        predictions = pred.tolist()
 
     return predictions
 
 
-def evaluate(model, nodes, data_loader, device='cuda:0'):
+def evaluate(model, nodes, data_loader, device=None, amp=False):
+    """
+    Args:
+        device (str or torch.device): device to move the data to. If `None`, use the
+            device the model is on.
+        amp (bool): whether to run the forward pass in bfloat16 autocast. Parameters
+            stay in float32, and the prediction is cast back to float32 before it is
+            scaled back with the label mean and stdev.
+    """
     model.eval()
 
-    predictions = []
-    with torch.no_grad():
+    if device is None:
+        device = next(model.parameters()).device
+    device_type = torch.device(device).type
+
+    # one prediction per reaction, written batch by batch on device and copied to the
+    # host once at the end, so there is no device to host sync per batch
+    predictions = torch.empty(len(data_loader.dataset), device=device)
+    start = 0
+
+    if device_type == "cuda":
+        # copy the next batch while the model runs on the current one; the `to()`
+        # calls below are then no-ops
+        data_loader = CUDAPrefetcher(data_loader, device)
+
+    with torch.inference_mode():
 
         for it, (bg, label) in enumerate(data_loader):
+            # the graph is moved together with its features
+            bg = bg.to(device, non_blocking=True)
             feats = {nt: bg.nodes[nt].data["feat"] for nt in nodes}
-            # print(feats['atom'][0])
-            norm_atom = label["norm_atom"]
-            norm_bond = label["norm_bond"]
-            mean = label["scaler_mean"].to(device)
-            stdev = label["scaler_stdev"].to(device)
-
-            if device is not None:
-                feats = {k: v.to(device) for k, v in feats.items()}
-                norm_atom = norm_atom.to(device)
-                norm_bond = norm_bond.to(device)
-
-            pred = model(bg, feats, label["reaction"], norm_atom, norm_bond)
-            pred = pred.view(-1)
+            norm_atom = label["norm_atom"].to(device, non_blocking=True)
+            norm_bond = label["norm_bond"].to(device, non_blocking=True)
+            mean = label["scaler_mean"].to(device, non_blocking=True)
+            stdev = label["scaler_stdev"].to(device, non_blocking=True)
+            reactions = reactions_to_device(
+                label["reaction"], device, non_blocking=True
+            )
+
+            with torch.autocast(device_type, dtype=torch.bfloat16, enabled=amp):
+                pred = model(bg, feats, reactions, norm_atom, norm_bond)
+            pred = pred.view(-1).float()
             # print(pred.device, stdev.device, mean.device)
 
-            pred = (pred * stdev + mean).cpu().numpy()
+            # scale back to the label scale, i.e. pred * stdev + mean, in one kernel
+            pred = torch.addcmul(mean, pred, stdev)
             # print(pred)
-            predictions.append(pred)
+            predictions[start : start + len(pred)] = pred
+            start += len(pred)
 
-    predictions = np.concatenate(predictions)
+    predictions = predictions.cpu().numpy()
 
     return predictions
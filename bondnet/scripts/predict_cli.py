@@ -2,8 +2,10 @@
 Script to make predictions using command line interface.
 """
 
+import os
 import bondnet
 import click
+import torch
 from bondnet.prediction.predictor import (
     predict_by_reactions,
     predict_multiple_molecules,
@@ -26,10 +28,67 @@ CONTEXT_SETTINGS = {"help_option_names": ["-h", "--help"]}
     show_default=True,
     help="prediction using model trained to the dataset, e.g. (pubchem and bdncm).",
 )
+@click.option(
+    "--num-threads",
+    type=int,
+    default=None,
+    help="number of threads for torch ops; if not provided, use OMP_NUM_THREADS if it "
+    "is set, otherwise at most 8 (more threads only add overhead for the small "
+    "matrices of a batch of molecules).",
+)
+@click.option(
+    "--device",
+    type=str,
+    default=None,
+    help="device to run the model on, e.g. cpu or cuda; if not provided, use the GPU "
+    "if one is available and the CPU otherwise.",
+)
+@click.option(
+    "--compile/--no-compile",
+    "compile_model",
+    default=False,
+    help="compile the dense layers of the model with torch.compile (torch >= 2.2); "
+    "compiling takes a while, so this pays off only for many molecules.",
+)
+@click.option(
+    "--amp/--no-amp",
+    default=False,
+    help="run the model in bfloat16 autocast; faster on hardware with native bfloat16 "
+    "support, at a small loss of precision.",
+)
+@click.option(
+    "--num-workers",
+    type=int,
+    default=0,
+    show_default=True,
+    help="number of worker processes to collate batches in; 0 to collate in the main "
+    "process, which is faster unless there are many molecules.",
+)
+@click.option(
+    "--cuda-graph/--no-cuda-graph",
+    default=False,
+    help="capture the fc layers of the model in a CUDA graph; only used on CUDA "
+    "devices.",
+)
 @click.version_option(version=bondnet.__version__)
 @click.pass_context
-def cli(ctx, model):
-    ctx.obj = model
+def cli(
+    ctx, model, num_threads, device, compile_model, amp, num_workers, cuda_graph
+):
+    if num_threads is None and "OMP_NUM_THREADS" not in os.environ:
+        num_threads = min(8, os.cpu_count() or 1)
+    if num_threads is not None:
+        torch.set_num_threads(num_threads)
+
+    # the model and the options of running it, passed to the prediction functions
+    options = {
+        "device": device,
+        "compile_model": compile_model,
+        "amp": amp,
+        "num_workers": num_workers,
+        "cuda_graph": cuda_graph,
+    }
+    ctx.obj = (model, options)
 
 
 @cli.command(context_settings=CONTEXT_SETTINGS)
@@ -50,15 +109,22 @@ def cli(ctx, model):
     "energies for graphically isomorphic bonds. So, this is just a convenience option.",
 )
 @click.pass_obj
-def single(model, molecule, charge, ring_bond, isomorphic_bond):
+def single(obj, molecule, charge, ring_bond, isomorphic_bond):
     """
     Make predictions for a molecule.
 
     MOLECULE is a SMILES string or InChI string.
     """
+    model, options = obj
     one_per_iso_bond_group = not isomorphic_bond
     return predict_single_molecule(
-        model, molecule, charge, ring_bond, one_per_iso_bond_group, write_result=True
+        model,
+        molecule,
+        charge,
+        ring_bond,
+        one_per_iso_bond_group,
+        write_result=True,
+        **options,
     )
 
 
@@ -100,11 +166,12 @@ def single(model, molecule, charge, ring_bond, isomorphic_bond):
 )
 @click.pass_obj
 def multiple(
-    model, molecule_file, charge_file, out_file, format, ring_bond, isomorphic_bond
+    obj, molecule_file, charge_file, out_file, format, ring_bond, isomorphic_bond
 ):
     """
     Make predictions for multiple molecules.
     """
+    model, options = obj
     return predict_multiple_molecules(
         model,
         molecule_file,
@@ -113,6 +180,7 @@ def multiple(
         format,
         ring_bond=ring_bond,
         one_per_iso_bond_group=not isomorphic_bond,
+        **options,
     )
 
 
@@ -140,7 +208,7 @@ def multiple(
     help="format of molecules",
 )
 @click.pass_obj
-def reaction(model, molecule_file, reaction_file, charge_file, out_file, format):
+def reaction(obj, molecule_file, reaction_file, charge_file, out_file, format):
     """
     Make predictions for bonds given as reactions.
 
@@ -149,6 +217,7 @@ def reaction(model, molecule_file, reaction_file, charge_file, out_file, format)
     REACTION_FILE is a csv file lists bond breaking reactions the molecules can form,
     specified by the index of the molecules.
     """
+    model, options = obj
     return predict_by_reactions(
-        model, molecule_file, reaction_file, charge_file, out_file, format
+        model, molecule_file, reaction_file, charge_file, out_file, format, **options
     )
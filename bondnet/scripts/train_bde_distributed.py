@@ -1,5 +1,8 @@
+import os
 import sys
 import time
+import inspect
+import tempfile
 import warnings
 import torch
 import argparse
@@ -14,7 +17,10 @@ from torch.nn.parallel import DistributedDataParallel as DDP
 from bondnet.model.metric import WeightedL1Loss, EarlyStopping
 from bondnet.model.gated_reaction_network import GatedGCNReactionNetwork
 from bondnet.data.dataset import train_validation_test_split, ReactionNetworkDataset
-from bondnet.data.dataloader import DataLoaderReactionNetwork
+from bondnet.data.dataloader import (
+    DataLoaderReactionNetwork,
+    reactions_to_device,
+)
 from bondnet.data.grapher import HeteroMoleculeGraph
 from bondnet.data.featurizer import (
     AtomFeaturizerFull,
@@ -73,6 +79,14 @@ def parse_args():
         help="number of layers for the LSTM in set2set readout layer",
     )
 
+    parser.add_argument(
+        "--readout",
+        type=str,
+        default="set2set",
+        choices=["set2set", "sum", "mean"],
+        help="readout layer; sum and mean reduce the nodes of each graph without LSTM",
+    )
+
     # fc layer
     parser.add_argument("--fc-num-layers", type=int, default=2)
     parser.add_argument("--fc-hidden-size", type=int, nargs="+", default=[384, 192])
@@ -86,6 +100,26 @@ def parse_args():
     parser.add_argument("--batch-size", type=int, default=100, help="batch size")
     parser.add_argument("--lr", type=float, default=0.001, help="learning rate")
     parser.add_argument("--weight-decay", type=float, default=0.0, help="weight decay")
+    parser.add_argument(
+        "--num-workers",
+        type=int,
+        default=0,
+        help="number of data loading worker processes; 0 to load in the main process. "
+        "A few workers (up to the number of CPUs) overlap data loading with training, "
+        "at the cost of a copy of the dataset state per worker.",
+    )
+    parser.add_argument(
+        "--amp",
+        type=int,
+        default=0,
+        help="bfloat16 mixed precision; the set2set readout stays in float32",
+    )
+    parser.add_argument(
+        "--compile",
+        type=int,
+        default=0,
+        help="torch.compile the dense (non message passing) layers and the loss",
+    )
     parser.add_argument("--restore", type=int, default=0, help="read checkpoints")
     parser.add_argument(
         "--dataset-state-dict-filename", type=str, default="dataset_state_dict.pkl"
@@ -113,6 +147,13 @@ def parse_args():
         help="url used to set up distributed training",
     )
     parser.add_argument("--dist-backend", type=str, default="nccl")
+    parser.add_argument(
+        "--cuda-graph",
+        type=int,
+        default=0,
+        help="capture the fc layers in CUDA graph; ignored on CPU or in distributed "
+        "mode",
+    )
 
     # output file (needed by hypertunity)
     parser.add_argument("--output_file", type=str, default="results.pkl")
@@ -139,11 +180,28 @@ def parse_args():
     return args
 
 
-def train(optimizer, model, nodes, data_loader, loss_fn, metric_fn, device=None):
+def train(
+    optimizer,
+    model,
+    nodes,
+    data_loader,
+    loss_fn,
+    metric_fn,
+    device=None,
+    amp=False,
+    loss_metric_fn=None,
+):
     """
     Args:
         metric_fn (function): the function should be using a `sum` reduction method.
+        amp (bool): whether to run the forward pass and loss in bfloat16 autocast.
+            Parameters and optimizer states stay in float32.
+        loss_metric_fn (function): function returning both the loss and the metric,
+            e.g. a compiled `loss_and_metric(loss_fn, metric_fn)`. If `None`, it is
+            created from `loss_fn` and `metric_fn`.
     """
+    if loss_metric_fn is None:
+        loss_metric_fn = loss_and_metric(loss_fn, metric_fn)
 
     model.train()
 
@@ -152,43 +210,51 @@ def train(optimizer, model, nodes, data_loader, loss_fn, metric_fn, device=None)
     count = 0.0
 
     for it, (bg, label) in enumerate(data_loader):
-        feats = {nt: bg.nodes[nt].data["feat"] for nt in nodes}
         target = label["value"]
         norm_atom = label["norm_atom"]
         norm_bond = label["norm_bond"]
         stdev = label["scaler_stdev"]
+        reactions = label["reaction"]
 
+        # move the graph (together with its features) to device once, so that it is
+        # not copied again in the layers of the model
         if device is not None:
-            feats = {k: v.to(device) for k, v in feats.items()}
-            target = target.to(device)
-            norm_atom = norm_atom.to(device)
-            norm_bond = norm_bond.to(device)
-            stdev = stdev.to(device)
+            bg = bg.to(device, non_blocking=True)
+            target = target.to(device, non_blocking=True)
+            norm_atom = norm_atom.to(device, non_blocking=True)
+            norm_bond = norm_bond.to(device, non_blocking=True)
+            stdev = stdev.to(device, non_blocking=True)
+            reactions = reactions_to_device(reactions, device, non_blocking=True)
+
+        feats = {nt: bg.nodes[nt].data["feat"] for nt in nodes}
 
-        pred = model(bg, feats, label["reaction"], norm_atom, norm_bond)
-        pred = pred.view(-1)
+        with torch.autocast(_device_type(device), dtype=torch.bfloat16, enabled=amp):
+            pred = model(bg, feats, reactions, norm_atom, norm_bond)
+            pred = pred.view(-1).float()
 
-        loss = loss_fn(pred, target)
-        optimizer.zero_grad()
+            loss, metric = loss_metric_fn(pred, target, stdev)
+        optimizer.zero_grad(set_to_none=True)
         loss.backward()
         optimizer.step()
 
-        epoch_loss += loss.detach().item()
-        accuracy += metric_fn(pred, target, stdev).detach().item()
+        # accumulate on device; calling item() here would sync at every step
+        epoch_loss += loss.detach()
+        accuracy += metric
         count += len(target)
 
-    epoch_loss /= it + 1
-    accuracy /= count
+    epoch_loss = epoch_loss.item() / (it + 1)
+    accuracy = accuracy.item() / count
 
     return epoch_loss, accuracy
 
 
-def evaluate(model, nodes, data_loader, metric_fn, device=None):
+def evaluate(model, nodes, data_loader, metric_fn, device=None, amp=False):
     """
     Evaluate the accuracy of an validation set of test set.
 
     Args:
         metric_fn (function): the function should be using a `sum` reduction method.
+        amp (bool): whether to run the forward pass in bfloat16 autocast.
     """
     model.eval()
 
@@ -197,26 +263,53 @@ def evaluate(model, nodes, data_loader, metric_fn, device=None):
         count = 0.0
 
         for it, (bg, label) in enumerate(data_loader):
-            feats = {nt: bg.nodes[nt].data["feat"] for nt in nodes}
             target = label["value"]
             norm_atom = label["norm_atom"]
             norm_bond = label["norm_bond"]
             stdev = label["scaler_stdev"]
+            reactions = label["reaction"]
 
             if device is not None:
-                feats = {k: v.to(device) for k, v in feats.items()}
-                target = target.to(device)
-                norm_atom = norm_atom.to(device)
-                norm_bond = norm_bond.to(device)
-                stdev = stdev.to(device)
+                bg = bg.to(device, non_blocking=True)
+                target = target.to(device, non_blocking=True)
+                norm_atom = norm_atom.to(device, non_blocking=True)
+                norm_bond = norm_bond.to(device, non_blocking=True)
+                stdev = stdev.to(device, non_blocking=True)
+                reactions = reactions_to_device(reactions, device, non_blocking=True)
+
+            feats = {nt: bg.nodes[nt].data["feat"] for nt in nodes}
 
-            pred = model(bg, feats, label["reaction"], norm_atom, norm_bond)
-            pred = pred.view(-1)
+            with torch.autocast(
+                _device_type(device), dtype=torch.bfloat16, enabled=amp
+            ):
+                pred = model(bg, feats, reactions, norm_atom, norm_bond)
+                pred = pred.view(-1).float()
 
-            accuracy += metric_fn(pred, target, stdev).detach().item()
+            accuracy += metric_fn(pred, target, stdev).detach()
             count += len(target)
 
-    return accuracy / count
+    return accuracy.item() / count
+
+
+def loss_and_metric(loss_fn, metric_fn):
+    """
+    Combine the loss and the metric into one function of `(pred, target, stdev)`
+    returning both, such that they can be compiled together into fused kernels. The
+    metric is computed on the detached prediction.
+    """
+
+    def fn(pred, target, stdev):
+        return loss_fn(pred, target), metric_fn(pred.detach(), target, stdev)
+
+    return fn
+
+
+def _device_type(device):
+    """
+    Device type (as needed by `torch.autocast`) of the device passed to `train()`,
+    where None means CPU.
+    """
+    return "cpu" if device is None else torch.device(device).type
 
 
 def get_grapher():
@@ -238,25 +331,10 @@ def get_grapher():
     return grapher
 
 
-def main_worker(gpu, world_size, args):
-    global best
-    args.gpu = gpu
-
-    if not args.distributed or (args.distributed and args.gpu == 0):
-        print("\n\nStart training at:", datetime.now())
-
-    if args.distributed:
-        dist.init_process_group(
-            args.dist_backend,
-            init_method=args.dist_url,
-            world_size=world_size,
-            rank=args.gpu,
-        )
-
-    # Explicitly setting seed to ensure the same dataset split and models created in
-    # two processes (when distributed) start from the same random weights and biases
-    seed_torch()
-
+def load_dataset(args):
+    """
+    Read the input files and create the dataset.
+    """
     if args.restore:
         dataset_state_dict_filename = args.dataset_state_dict_filename
 
@@ -285,6 +363,34 @@ def main_worker(gpu, world_size, args):
         state_dict_filename=dataset_state_dict_filename,
     )
 
+    return dataset
+
+
+def main_worker(gpu, world_size, args, dataset):
+    """
+    Args:
+        dataset (ReactionNetworkDataset): the dataset created by `load_dataset()`. In
+            distributed mode, it is created once in the parent process and loaded by
+            each process from the file written by `spawn_with_dataset()`.
+    """
+    global best
+    args.gpu = gpu
+
+    if not args.distributed or (args.distributed and args.gpu == 0):
+        print("\n\nStart training at:", datetime.now())
+
+    if args.distributed:
+        dist.init_process_group(
+            args.dist_backend,
+            init_method=args.dist_url,
+            world_size=world_size,
+            rank=args.gpu,
+        )
+
+    # Explicitly setting seed to ensure the same dataset split and models created in
+    # two processes (when distributed) start from the same random weights and biases
+    seed_torch()
+
     trainset, valset, testset = train_validation_test_split(
         dataset, validation=0.1, test=0.1
     )
@@ -302,18 +408,32 @@ def main_worker(gpu, world_size, args):
     else:
         train_sampler = None
 
+    # pinned memory enables asynchronous host to device copy
+    loader_kwargs = {"pin_memory": args.gpu is not None}
+    if args.num_workers > 0:
+        # keep workers (and the dataset copy in them) alive across epochs, and collate
+        # (including the reaction gather indices) a few batches ahead of the model
+        loader_kwargs.update(
+            num_workers=args.num_workers, persistent_workers=True, prefetch_factor=4
+        )
+
     train_loader = DataLoaderReactionNetwork(
         trainset,
         batch_size=args.batch_size,
         shuffle=(train_sampler is None),
         sampler=train_sampler,
+        **loader_kwargs,
     )
     # larger val and test set batch_size is faster but needs more memory
     # adjust the batch size of to fit memory
     bs = max(len(valset) // 10, 1)
-    val_loader = DataLoaderReactionNetwork(valset, batch_size=bs, shuffle=False)
+    val_loader = DataLoaderReactionNetwork(
+        valset, batch_size=bs, shuffle=False, **loader_kwargs
+    )
     bs = max(len(testset) // 10, 1)
-    test_loader = DataLoaderReactionNetwork(testset, batch_size=bs, shuffle=False)
+    test_loader = DataLoaderReactionNetwork(
+        testset, batch_size=bs, shuffle=False, **loader_kwargs
+    )
 
     ### model
 
@@ -349,6 +469,7 @@ def main_worker(gpu, world_size, args):
         fc_dropout=args.fc_dropout,
         outdim=1,
         conv="GatedGCNConv",
+        readout=args.readout,
     )
 
     if not args.distributed or (args.distributed and args.gpu == 0):
@@ -356,19 +477,49 @@ def main_worker(gpu, world_size, args):
 
     if args.gpu is not None:
         model.to(args.gpu)
+        if args.cuda_graph and not args.distributed:
+            model.capture_fc_layers(args.batch_size)
+    # in-place `nn.Module.compile()` is only available in torch >= 2.2
+    if args.compile and not hasattr(torch.nn.Module, "compile"):
+        warnings.warn(
+            f"torch {torch.__version__} does not support compiling modules in place; "
+            "disable --compile"
+        )
+        args.compile = False
+    if args.compile:
+        model.compile_dense_layers(dynamic=True)
+    if args.amp and args.gpu is not None and not torch.cuda.is_bf16_supported():
+        warnings.warn("bfloat16 is not supported on this GPU; disable --amp")
+        args.amp = False
     if args.distributed:
         ddp_model = DDP(model, device_ids=[args.gpu])
         ddp_model.feature_before_fc = model.feature_before_fc
         model = ddp_model
 
     ### optimizer, loss, and metric
+    # fused (single kernel) update is only available for parameters on GPU, and the
+    # `fused` argument only exists in torch >= 1.13
+    optimizer_kwargs = {}
+    if (
+        args.gpu is not None
+        and "fused" in inspect.signature(torch.optim.Adam).parameters
+    ):
+        optimizer_kwargs["fused"] = True
     optimizer = torch.optim.Adam(
-        model.parameters(), lr=args.lr, weight_decay=args.weight_decay
+        model.parameters(),
+        lr=args.lr,
+        weight_decay=args.weight_decay,
+        **optimizer_kwargs,
     )
 
     loss_func = MSELoss(reduction="mean")
     metric = WeightedL1Loss(reduction="sum")
 
+    # loss and metric of a training step (a few tiny elementwise kernels each)
+    loss_metric = loss_and_metric(loss_func, metric)
+    if args.compile:
+        loss_metric = torch.compile(loss_metric, dynamic=True)
+
     ### learning rate scheduler and stopper
     scheduler = ReduceLROnPlateau(
         optimizer, mode="min", factor=0.4, patience=50, verbose=True
@@ -412,7 +563,15 @@ def main_worker(gpu, world_size, args):
 
         # train
         loss, train_acc = train(
-            optimizer, model, feature_names, train_loader, loss_func, metric, args.gpu
+            optimizer,
+            model,
+            feature_names,
+            train_loader,
+            loss_func,
+            metric,
+            args.gpu,
+            bool(args.amp),
+            loss_metric,
         )
 
         # bad, we get nan
@@ -422,7 +581,9 @@ def main_worker(gpu, world_size, args):
             sys.exit(1)
 
         # evaluate
-        val_acc = evaluate(model, feature_names, val_loader, metric, args.gpu)
+        val_acc = evaluate(
+            model, feature_names, val_loader, metric, args.gpu, bool(args.amp)
+        )
 
         if stopper.step(val_acc):
             pickle_dump(best, args.output_file)  # save results for hyperparam tune
@@ -468,24 +629,59 @@ def main_worker(gpu, world_size, args):
         )
 
     if not args.distributed or (args.distributed and args.gpu == 0):
-        test_acc = evaluate(model, feature_names, test_loader, metric, args.gpu)
+        test_acc = evaluate(
+            model, feature_names, test_loader, metric, args.gpu, bool(args.amp)
+        )
 
         print("\n#TestAcc: {:12.6e} \n".format(test_acc))
         print("\nFinish training at:", datetime.now())
 
 
+def spawn_with_dataset(fn, nprocs, args, dataset):
+    """
+    Run `fn(rank, *args, dataset)` in `nprocs` spawned processes.
+
+    The dataset is written once to a file (in `/dev/shm` if available) and each process
+    loads it from there. Passing the dataset to `mp.spawn()` directly would share each
+    tensor of each molecule graph through a file descriptor of its own, which exceeds
+    the limit of open files already for small datasets.
+    """
+    shm = Path("/dev/shm")
+    fd, filename = tempfile.mkstemp(suffix=".pkl", dir=shm if shm.is_dir() else None)
+    os.close(fd)
+    try:
+        # unlike pickle, torch.save writes the storage shared by the feature tensors of
+        # the molecules (views into the batched features) only once
+        torch.save(dataset, filename)
+        mp.spawn(_run_with_dataset, nprocs=nprocs, args=(fn, args, filename))
+    finally:
+        os.remove(filename)
+
+
+def _run_with_dataset(rank, fn, args, filename):
+    # the dataset is not plain tensors; `weights_only` only exists in torch >= 1.13
+    load_kwargs = {}
+    if "weights_only" in inspect.signature(torch.load).parameters:
+        load_kwargs["weights_only"] = False
+    fn(rank, *args, torch.load(filename, **load_kwargs))
+
+
 def main():
     args = parse_args()
     print(args)
 
+    # read the input files and featurize the molecules only once; in distributed
+    # mode, the spawned processes load the dataset instead of creating it again
+    dataset = load_dataset(args)
+
     if args.distributed:
         # DDP
         world_size = torch.cuda.device_count() if args.num_gpu is None else args.num_gpu
-        mp.spawn(main_worker, nprocs=world_size, args=(world_size, args))
+        spawn_with_dataset(main_worker, world_size, (world_size, args), dataset)
 
     else:
         # train on CPU or a single GPU
-        main_worker(args.gpu, None, args)
+        main_worker(args.gpu, None, args, dataset)
 
 
 if __name__ == "__main__":
@@ -1,5 +1,6 @@
 import sys
 import time
+import inspect
 import warnings
 import torch
 import argparse
@@ -173,16 +174,17 @@ def train(optimizer, model, nodes, data_loader, loss_fn, metric_fn, device=None)
         pred = pred[index]
 
         loss = loss_fn(pred, target)
-        optimizer.zero_grad()
+        optimizer.zero_grad(set_to_none=True)
         loss.backward()
         optimizer.step()
 
-        epoch_loss += loss.detach().item()
-        accuracy += metric_fn(pred, target, stdev).detach().item()
+        # accumulate on device; calling item() here would sync at every step
+        epoch_loss += loss.detach()
+        accuracy += metric_fn(pred, target, stdev).detach()
         count += len(target)
 
-    epoch_loss /= it + 1
-    accuracy /= count
+    epoch_loss = epoch_loss.item() / (it + 1)
+    accuracy = accuracy.item() / count
 
     return epoch_loss, accuracy
 
@@ -225,10 +227,10 @@ def evaluate(model, nodes, data_loader, metric_fn, device=None):
             pred = model(bg, feats, norm_atom, norm_bond)
             pred = pred[index]
 
-            accuracy += metric_fn(pred, target, stdev).detach().item()
+            accuracy += metric_fn(pred, target, stdev).detach()
             count += len(target)
 
-    return accuracy / count
+    return accuracy.item() / count
 
 
 def get_grapher():
@@ -378,8 +380,19 @@ def main_worker(gpu, world_size, args):
         model = ddp_model
 
     ### optimizer, loss, and metric
+    # fused (single kernel) update is only available for parameters on GPU, and the
+    # `fused` argument only exists in torch >= 1.13
+    optimizer_kwargs = {}
+    if (
+        args.gpu is not None
+        and "fused" in inspect.signature(torch.optim.Adam).parameters
+    ):
+        optimizer_kwargs["fused"] = True
     optimizer = torch.optim.Adam(
-        model.parameters(), lr=args.lr, weight_decay=args.weight_decay
+        model.parameters(),
+        lr=args.lr,
+        weight_decay=args.weight_decay,
+        **optimizer_kwargs,
     )
 
     loss_func = MSELoss(reduction="mean")
@@ -4,6 +4,7 @@ Here we mainly test the correctness of batch.
 """
 
 from pathlib import Path
+import pytest
 import torch
 import numpy as np
 from bondnet.data.dataset import BondDataset, ReactionDataset, ReactionNetworkDataset
@@ -13,6 +14,7 @@ from bondnet.data.dataloader import (
     DataLoader,
     DataLoaderReaction,
     DataLoaderReactionNetwork,
+    CUDAPrefetcher,
 )
 from bondnet.data.grapher import HeteroMoleculeGraph, HomoCompleteGraph
 from bondnet.data.featurizer import (
@@ -176,3 +178,49 @@ def test_dataloader_reaction_network():
     data_loader = DataLoaderReactionNetwork(dataset, batch_size=2, shuffle=False)
     for graph, labels in data_loader:
         assert np.allclose(labels["value"], ref_label_class)
+
+
+@pytest.mark.skipif(not torch.cuda.is_available(), reason="requires CUDA")
+def test_cuda_prefetcher():
+    dataset = ReactionNetworkDataset(
+        grapher=get_grapher_hetero(),
+        molecules=test_files.joinpath("electrolyte_struct_rxn_ntwk_clfn.sdf"),
+        labels=test_files.joinpath("electrolyte_label_rxn_ntwk_clfn.yaml"),
+        extra_features=test_files.joinpath("electrolyte_feature_rxn_ntwk_clfn.yaml"),
+        feature_transformer=False,
+        label_transformer=False,
+    )
+    data_loader = DataLoaderReactionNetwork(
+        dataset, batch_size=1, shuffle=False, pin_memory=True
+    )
+    device = torch.device("cuda")
+    prefetcher = CUDAPrefetcher(data_loader, device)
+    assert len(prefetcher) == len(data_loader)
+
+    ref_batches = list(data_loader)
+    results = []
+    for graph, labels in prefetcher:
+        assert graph.device.type == "cuda"
+        assert labels["value"].device.type == "cuda"
+
+        # delay the current stream so that the work below is still queued when the
+        # batch is released and the next batch is copied on the side stream; without
+        # record_stream, the copy could then reuse the memory of this batch
+        torch.cuda._sleep(int(1e8))
+        feats = {nt: graph.nodes[nt].data["feat"] * 1 for nt in graph.ntypes}
+        index = {
+            nt: {k: v * 1 for k, v in idx.items() if isinstance(v, torch.Tensor)}
+            for nt, idx in labels["reaction"]["index"].items()
+        }
+        results.append((feats, labels["value"] * 1, index))
+        del graph, labels
+    torch.cuda.synchronize()
+
+    assert len(results) == len(ref_batches)
+    for (feats, value, index), (ref_graph, ref_labels) in zip(results, ref_batches):
+        for nt in ref_graph.ntypes:
+            assert torch.equal(feats[nt].cpu(), ref_graph.nodes[nt].data["feat"])
+        assert torch.equal(value.cpu(), ref_labels["value"])
+        for nt, idx in index.items():
+            for k, v in idx.items():
+                assert torch.equal(v.cpu(), ref_labels["reaction"]["index"][nt][k])
@@ -228,6 +228,9 @@ def test_electrolyte_reaction_network_label():
 
         size = len(dataset)
         assert size == 2
+        assert dataset.failed == [False, False]
+        assert np.array_equal(dataset.success_indices, [0, 1])
+        assert dataset.n_total == 2
 
         for i in range(size):
             rn, rxn, label = dataset[i]
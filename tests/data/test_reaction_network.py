@@ -1,5 +1,9 @@
 import numpy as np
-from bondnet.data.reaction_network import ReactionInNetwork, ReactionNetwork
+from bondnet.data.reaction_network import (
+    ReactionInNetwork,
+    ReactionNetwork,
+    reaction_gather_index,
+)
 
 
 class TestReaction:
@@ -23,6 +27,20 @@ class TestReaction:
         assert_one([{0: 1, 1: 2}, {}], [2, 0, 1], "bond")
         assert_one([{}, {0: 1, 1: 2}, {}], [2, 0, 1], "bond")
 
+    def test_product_index(self):
+        rxn = ReactionInNetwork(
+            reactants=[0],
+            products=[1, 2],
+            atom_mapping=[{0: 1, 1: 2}, {0: 0}],
+            bond_mapping=[{0: 1}, {}],
+        )
+        mol, node = rxn.product_index["atom"]
+        assert np.array_equal(mol, [1, 0, 0])
+        assert np.array_equal(node, [0, 0, 1])
+        mol, node = rxn.product_index["bond"]
+        assert np.array_equal(mol, [-1, 0])
+        assert np.array_equal(node, [0, 0])
+
 
 class TestReactionNetwork:
     def test_get_molecules_in_reactions(self):
@@ -41,3 +59,27 @@ class TestReactionNetwork:
         for i, rxn in enumerate(sub_rxns):
             assert rxn.reactants == ref_reactants[i]
             assert rxn.products == ref_products[i]
+
+
+def test_reaction_gather_index():
+    # mol 0: 3 atoms, 2 bonds (reactant)
+    # mol 1: 2 atoms, 1 bond (product)
+    # mol 2: 1 atom, 1 factitious bond (product)
+    rxn = ReactionInNetwork(
+        reactants=[0],
+        products=[1, 2],
+        atom_mapping=[{0: 1, 1: 2}, {0: 0}],
+        bond_mapping=[{0: 1}, {}],
+    )
+    index = reaction_gather_index(
+        [rxn, rxn], sizes_atom=[3, 2, 1], sizes_bond=[2, 1, 1]
+    )
+
+    assert np.array_equal(index["atom"]["reactant"], [0, 1, 2, 0, 1, 2])
+    assert np.array_equal(index["atom"]["product"], [5, 3, 4, 5, 3, 4])
+    assert np.array_equal(index["bond"]["reactant"], [0, 1, 0, 1])
+    assert np.array_equal(index["bond"]["product"], [0, 2, 0, 2])
+    assert np.array_equal(index["bond"]["broken"], [0, 2])
+    assert np.array_equal(index["global"]["reactant"], [0, 0])
+    assert np.array_equal(index["global"]["product"], [1, 2, 1, 2])
+    assert np.array_equal(index["global"]["segment"], [0, 0, 1, 1])
@@ -1,9 +1,11 @@
 import numpy as np
+import torch
 from bondnet.layer.readout import (
     ConcatenateMeanMax,
     ConcatenateMeanAbsDiff,
     Set2Set,
     Set2SetThenCat,
+    SegmentReduceThenCat,
 )
 from ..utils import make_hetero_CH2O, make_batched_hetero_CH2O
 
@@ -65,3 +67,40 @@ def test_set2set_then_cat():
     )
     rst = layer(g, feats)
     assert rst.shape == (nbatch, 2 * 2 + 3 * 2 + 4)
+
+
+def test_segment_reduce_then_cat():
+    nbatch = 3
+    g, feats = make_batched_hetero_CH2O(nbatch)
+    g0, feats0 = make_hetero_CH2O()
+
+    for reducer in ["sum", "mean"]:
+        layer = SegmentReduceThenCat(
+            ntypes=["atom", "bond"], ntypes_direct_cat=["global"], reducer=reducer
+        )
+        rst = layer(g, feats)
+        assert rst.shape == (nbatch, 2 + 3 + 4)
+
+        fn = np.sum if reducer == "sum" else np.mean
+        ref = np.concatenate(
+            [
+                fn(feats0["atom"].numpy(), axis=0),
+                fn(feats0["bond"].numpy(), axis=0),
+                feats0["global"].numpy()[0],
+            ]
+        )
+        assert np.allclose(rst, [ref] * nbatch)
+
+        # under bfloat16 autocast (e.g. training with --amp), the reduction is done in
+        # float32 since DGL has no bfloat16 segment reduce kernel on CPU
+        feats_bf16 = {nt: ft.to(torch.bfloat16) for nt, ft in feats.items()}
+        with torch.autocast("cpu", dtype=torch.bfloat16):
+            rst = layer(g, feats_bf16)
+        assert rst.dtype == torch.bfloat16
+        assert np.allclose(rst.float(), [ref] * nbatch, rtol=1e-2, atol=1e-2)
+
+        # other precisions are kept
+        feats_fp64 = {nt: ft.double() for nt, ft in feats.items()}
+        rst = layer(g, feats_fp64)
+        assert rst.dtype == torch.float64
+        assert np.allclose(rst, [ref] * nbatch)
@@ -0,0 +1,63 @@
+import pytest
+import torch
+from bondnet.model.gated_mol import GatedGCNMol
+
+
+def get_model():
+    return GatedGCNMol(
+        in_feats={"atom": 2, "bond": 3, "global": 4},
+        embedding_size=8,
+        gated_num_layers=1,
+        gated_hidden_size=[8],
+        num_lstm_iters=2,
+        num_lstm_layers=1,
+        fc_num_layers=2,
+        fc_hidden_size=[8, 4],
+        fc_batch_norm=True,
+    )
+
+
+def get_fc_input(model, batch_size, device=None):
+    in_size = model.fc_layers[0].in_features
+    return torch.randn(batch_size, in_size, device=device)
+
+
+@pytest.mark.skipif(not torch.cuda.is_available(), reason="requires CUDA")
+def test_capture_fc_layers():
+    batch_size = 5
+
+    # training: forward and backward captured, used with grad enabled in train mode
+    model = get_model().cuda()
+    model.capture_fc_layers(batch_size)
+    for bs in [batch_size, batch_size - 2]:
+        x = get_fc_input(model, bs, "cuda")
+        ref = model._fc_forward_eager(x)
+        # batch norm normalizes with batch statistics in train mode, so the graphed
+        # and eager results are the same for the same input
+        rst = model.fc_forward(x)
+        assert torch.allclose(rst, ref, atol=1e-6)
+
+    # inference: forward only, used with grad disabled in eval mode
+    model = get_model().cuda().eval()
+    model.capture_fc_layers(batch_size, inference=True)
+    with torch.inference_mode():
+        xs = [get_fc_input(model, bs, "cuda") for bs in [batch_size, batch_size - 2]]
+        results = [model.fc_forward(x) for x in xs]
+        for x, rst in zip(xs, results):
+            # results of earlier calls are not overwritten by later replays
+            assert torch.allclose(rst, model._fc_forward_eager(x), atol=1e-6)
+
+
+@pytest.mark.skipif(
+    not hasattr(torch.nn.Module, "compile"), reason="requires torch.compile"
+)
+def test_compile_dense_layers():
+    model = get_model().eval()
+    model.compile_dense_layers(dynamic=True)
+    assert model._compiled_fc_forward is not None
+
+    with torch.no_grad():
+        for bs in [5, 3]:
+            x = get_fc_input(model, bs)
+            rst = model.fc_forward(x)
+            assert torch.allclose(rst, model._fc_forward_eager(x), atol=1e-5)
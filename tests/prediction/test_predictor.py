@@ -1,8 +1,10 @@
 from pathlib import Path
+import pytest
 from click.testing import CliRunner
 import bondnet
 from bondnet.prediction.predictor import (
     predict_single_molecule,
+    predict_molecules,
     predict_multiple_molecules,
     predict_by_reactions,
 )
@@ -14,6 +16,17 @@ def test_predict_single_molecule():
     predict_single_molecule(model_name="pubchem", molecule="CC")
 
 
+def test_predict_molecules():
+    molecules = ["CC", "CCO"]
+    bond_dicts = predict_molecules(model_name="pubchem", molecules=molecules)
+    assert len(bond_dicts) == len(molecules)
+    for mol, bonds in zip(molecules, bond_dicts):
+        ref = predict_single_molecule(model_name="pubchem", molecule=mol, output="dict")
+        assert bonds.keys() == ref.keys()
+        for b, e in bonds.items():
+            assert e == (None if ref[b] is None else pytest.approx(ref[b], rel=1e-4))
+
+
 def test_predict_multiple_molecules():
     prefix = Path(bondnet.__file__).parent.joinpath("scripts", "examples", "predict")
     molecule_file = prefix.joinpath("molecules.sdf")
@@ -65,6 +78,11 @@ def test_cli():
     runner = CliRunner()
     result = runner.invoke(cli, ["single", "CC", "0"])
 
+    result = runner.invoke(
+        cli, ["--device", "cpu", "--amp", "--num-workers", "1", "single", "CC"]
+    )
+    assert result.exit_code == 0, result.output
+
     molecule_file = Path(bondnet.__file__).parent.joinpath(
         "prediction", "examples", "molecules.sdf"
     )
@@ -0,0 +1,41 @@
+import argparse
+import resource
+from pathlib import Path
+import torch
+import bondnet
+from bondnet.scripts.train_bde_distributed import load_dataset, spawn_with_dataset
+
+
+def check_dataset(rank, size, num_molecules, feats, dataset):
+    assert len(dataset) == size
+    molecules = dataset.reaction_network.molecules
+    assert len(molecules) == num_molecules
+    for nt, ft in feats.items():
+        assert torch.equal(molecules[-1].nodes[nt].data["feat"], ft)
+
+
+def test_spawn_with_dataset():
+    prefix = Path(bondnet.__file__).parent.joinpath("scripts", "examples", "train")
+    args = argparse.Namespace(
+        restore=0,
+        molecule_file=prefix.joinpath("molecules.sdf"),
+        molecule_attributes_file=prefix.joinpath("molecule_attributes.yaml"),
+        reaction_file=prefix.joinpath("reactions.yaml"),
+    )
+    dataset = load_dataset(args)
+
+    molecules = dataset.reaction_network.molecules
+    assert len(molecules) > 400
+    g = molecules[-1]
+    feats = {nt: g.nodes[nt].data["feat"] for nt in g.ntypes}
+
+    # sharing each tensor of the molecule graphs through a file descriptor of its own
+    # would exceed this limit
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (min(soft, 1024), hard))
+    try:
+        spawn_with_dataset(
+            check_dataset, 2, (len(dataset), len(molecules), feats), dataset
+        )
+    finally:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (soft, hard))